@@ -1,17 +1,19 @@
 from __future__ import annotations
 import argparse
 import copy
-from datetime import datetime
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
 from enum import Enum
 from dataclasses import dataclass, field
-from time import sleep
-from typing import Tuple, TypeVar, Type, Iterable, ClassVar
+from time import sleep, monotonic_ns
+from typing import Tuple, TypeVar, Type, Iterable, ClassVar, TextIO
 import random
 import requests
 
 # maximum and minimum values for our heuristic scores (usually represents an end of game condition)
 MAX_HEURISTIC_SCORE = 2000000000
 MIN_HEURISTIC_SCORE = -2000000000
+# most positions a transposition table keeps (new positions are not stored beyond that)
+MAX_TRANSPOSITION_ENTRIES = 1000000
 
 
 class UnitType(Enum):
@@ -50,6 +52,23 @@ class GameType(Enum):
     CompVsComp = 3
 
 
+class BoundType(Enum):
+    """How a transposition table score relates to the true minimax value."""
+    EXACT = 0
+    LOWER = 1
+    UPPER = 2
+
+
+##############################################################################################################
+
+# lookup tables for parsing coordinates: separators stripped from the input, row letters and column digits
+_COORD_SEPARATORS = str.maketrans("", "", " ,.:;-_")
+_ROW_INDEX = {c: i for (i, c) in enumerate("ABCDEFGHIJKLMNOPQRSTUVWXYZ")}
+_ROW_INDEX.update({c.lower(): i for (c, i) in list(_ROW_INDEX.items())})
+_COL_INDEX = {c: i for (i, c) in enumerate("0123456789abcdef")}
+_COL_INDEX.update({c.upper(): i for (c, i) in list(_COL_INDEX.items())})
+
+
 ##############################################################################################################
 
 @dataclass(slots=True)
@@ -57,6 +76,9 @@ class Unit:
     player: Player = Player.Attacker
     type: UnitType = UnitType.Program
     health: int = 9
+    # plain int copies of player.value and type.value for table lookups in hot paths
+    player_idx: int = field(init=False, repr=False, compare=False)
+    type_idx: int = field(init=False, repr=False, compare=False)
     # class variable: damage table for units (based on the unit type constants in order)
     damage_table: ClassVar[list[list[int]]] = [
         [3, 3, 3, 3, 1],  # AI
@@ -73,6 +95,15 @@ class Unit:
         [0, 0, 0, 0, 0],  # Program
         [0, 0, 0, 0, 0],  # Firewall
     ]
+    # class variables: damage_amount/repair_amount results per unit type, target type and target health
+    # (read directly by Game.perform_attack_fast/perform_repair_fast)
+    damage_lut: ClassVar[list[list[list[int]]]]
+    repair_lut: ClassVar[list[list[list[int]]]]
+
+    def __post_init__(self):
+        """Cache the enum values of player and type as ints."""
+        self.player_idx = self.player.value
+        self.type_idx = self.type.value
 
     def is_alive(self) -> bool:
         """Are we alive ?"""
@@ -96,19 +127,21 @@ class Unit:
         """Text representation of this unit."""
         return self.to_string()
 
+    def clone(self) -> Unit:
+        """Clone a Unit."""
+        return Unit(self.player, self.type, self.health)
+
     def damage_amount(self, target: Unit) -> int:
         """How much can this unit damage another unit."""
-        amount = self.damage_table[self.type.value][target.type.value]
-        if target.health - amount < 0:
-            return target.health
-        return amount
+        return self.damage_lut[self.type_idx][target.type_idx][target.health]
 
     def repair_amount(self, target: Unit) -> int:
         """How much can this unit repair another unit."""
-        amount = self.repair_table[self.type.value][target.type.value]
-        if target.health + amount > 9:
-            return 9 - target.health
-        return amount
+        return self.repair_lut[self.type_idx][target.type_idx][target.health]
+
+
+Unit.damage_lut = [[[min(amount, health) for health in range(10)] for amount in row] for row in Unit.damage_table]
+Unit.repair_lut = [[[min(amount, 9 - health) for health in range(10)] for amount in row] for row in Unit.repair_table]
 
 
 ##############################################################################################################
@@ -143,7 +176,7 @@ class Coord:
 
     def clone(self) -> Coord:
         """Clone a Coord."""
-        return copy.copy(self)
+        return Coord(self.row, self.col)
 
     def iter_range(self, dist: int) -> Iterable[Coord]:
         """Iterates over Coords inside a rectangle centered on our Coord."""
@@ -161,14 +194,9 @@ class Coord:
     @classmethod
     def from_string(cls, s: str) -> Coord | None:
         """Create a Coord from a string. ex: D2."""
-        s = s.strip()
-        for sep in " ,.:;-_":
-            s = s.replace(sep, "")
+        s = s.strip().translate(_COORD_SEPARATORS)
         if (len(s) == 2):
-            coord = Coord()
-            coord.row = "ABCDEFGHIJKLMNOPQRSTUVWXYZ".find(s[0:1].upper())
-            coord.col = "0123456789abcdef".find(s[1:2].lower())
-            return coord
+            return Coord(_ROW_INDEX.get(s[0], -1), _COL_INDEX.get(s[1], -1))
         else:
             return None
 
@@ -191,7 +219,7 @@ class CoordPair:
 
     def clone(self) -> CoordPair:
         """Clones a CoordPair."""
-        return copy.copy(self)
+        return CoordPair(Coord(self.src.row, self.src.col), Coord(self.dst.row, self.dst.col))
 
     def iter_rectangle(self) -> Iterable[Coord]:
         """Iterates over cells of a rectangular area."""
@@ -212,20 +240,76 @@ class CoordPair:
     @classmethod
     def from_string(cls, s: str) -> CoordPair | None:
         """Create a CoordPair from a string. ex: A3 B2"""
-        s = s.strip()
-        for sep in " ,.:;-_":
-            s = s.replace(sep, "")
+        s = s.strip().translate(_COORD_SEPARATORS)
         if (len(s) == 4):
-            coords = CoordPair()
-            coords.src.row = "ABCDEFGHIJKLMNOPQRSTUVWXYZ".find(s[0:1].upper())
-            coords.src.col = "0123456789abcdef".find(s[1:2].lower())
-            coords.dst.row = "ABCDEFGHIJKLMNOPQRSTUVWXYZ".find(s[2:3].upper())
-            coords.dst.col = "0123456789abcdef".find(s[3:4].lower())
-            return coords
+            return CoordPair.from_quad(_ROW_INDEX.get(s[0], -1), _COL_INDEX.get(s[1], -1),
+                                       _ROW_INDEX.get(s[2], -1), _COL_INDEX.get(s[3], -1))
         else:
             return None
 
 
+##############################################################################################################
+
+# random keys for zobrist hashing, one per (cell, player, unit type, health) and one for the side to move
+ZOBRIST_SIDE_KEY = random.Random(0).getrandbits(64)
+_zobrist_tables: dict[int, list[int]] = {}
+
+
+def zobrist_table(dim: int) -> list[int]:
+    """Zobrist keys for a dim-sized board, indexed by ((cell * 2 + player) * 5 + type) * 10 + health."""
+    table = _zobrist_tables.get(dim)
+    if table is None:
+        rng = random.Random(dim)
+        table = [rng.getrandbits(64) for _ in range(dim * dim * 2 * 5 * 10)]
+        _zobrist_tables[dim] = table
+    return table
+
+
+_adjacent_tables: dict[int, list[Tuple[int, ...]]] = {}
+
+
+def adjacent_table(dim: int) -> list[Tuple[int, ...]]:
+    """Flat indices of the in-bounds cells adjacent to each cell of a dim-sized board (same order as iter_adjacent)."""
+    table = _adjacent_tables.get(dim)
+    if table is None:
+        table = []
+        for row in range(dim):
+            for col in range(dim):
+                neighbours = ((row - 1, col), (row, col - 1), (row + 1, col), (row, col + 1))
+                table.append(tuple(r * dim + c for (r, c) in neighbours if 0 <= r < dim and 0 <= c < dim))
+        _adjacent_tables[dim] = table
+    return table
+
+
+_range_tables: dict[int, list[Tuple[int, ...]]] = {}
+
+
+def range_table(dim: int) -> list[Tuple[int, ...]]:
+    """Flat indices of the in-bounds 3x3 area around each cell of a dim-sized board (same order as iter_range(1))."""
+    table = _range_tables.get(dim)
+    if table is None:
+        table = []
+        for row in range(dim):
+            for col in range(dim):
+                table.append(tuple(r * dim + c for r in range(row - 1, row + 2) for c in range(col - 1, col + 2)
+                                   if 0 <= r < dim and 0 <= c < dim))
+        _range_tables[dim] = table
+    return table
+
+
+_move_tables: dict[int, list[Tuple[Tuple[int, int], ...]]] = {}
+
+
+def move_table(dim: int) -> list[Tuple[Tuple[int, int], ...]]:
+    """Every (src, dst) move from each cell of a dim-sized board: to each adjacent cell, then onto itself."""
+    table = _move_tables.get(dim)
+    if table is None:
+        table = [tuple((src, dst) for dst in adjacent) + ((src, src),)
+                 for (src, adjacent) in enumerate(adjacent_table(dim))]
+        _move_tables[dim] = table
+    return table
+
+
 ##############################################################################################################
 
 @dataclass(slots=True)
@@ -236,11 +320,17 @@ class Options:
     min_depth: int | None = 2
     max_time: float | None = 5.0
     game_type: GameType = GameType.AttackerVsDefender
-    alpha_beta: bool = False
+    alpha_beta: bool = True
     max_turns: int | None = 100
     randomize_moves: bool = True
     broker: str | None = None
-    file = 'gametrace-' + str(alpha_beta) + '-' + str(max_time) + '-' + str(max_turns) + '.txt'
+    # number of processes searching the root moves in parallel (1 searches in this process only)
+    workers: int = 1
+
+    @property
+    def file(self) -> str:
+        """Name of the game trace file for these options."""
+        return 'gametrace-' + str(self.alpha_beta) + '-' + str(self.max_time) + '-' + str(self.max_turns) + '.txt'
 
 
 ##############################################################################################################
@@ -252,23 +342,67 @@ class Stats:
     total_seconds: float = 0.0
 
 
+##############################################################################################################
+
+@dataclass(slots=True)
+class UndoRecord:
+    """Everything needed to take back a move performed by Game.do_move."""
+    cells: list[Tuple[int, Unit | None, int]] = field(default_factory=list)
+    next_player: Player = Player.Attacker
+    turns_played: int = 0
+    attacker_has_ai: bool = True
+    defender_has_ai: bool = True
+    zobrist: int = 0
+
+
 ##############################################################################################################
 
 @dataclass(slots=True)
 class Game:
     """Representation of the game state."""
-    board: list[list[Unit | None]] = field(default_factory=list)
+    board: list[Unit | None] = field(default_factory=list)
     next_player: Player = Player.Attacker
     turns_played: int = 0
     options: Options = field(default_factory=Options)
     stats: Stats = field(default_factory=Stats)
     _attacker_has_ai: bool = True
     _defender_has_ai: bool = True
+    _trace_file: TextIO | None = field(default=None, repr=False, compare=False)
+    # search bookkeeping: nodes visited since the last clock check, and whether the time limit was hit
+    _node_count: int = field(default=0, repr=False, compare=False)
+    _timed_out: bool = field(default=False, repr=False, compare=False)
+    _executor: ProcessPoolExecutor | None = field(default=None, repr=False, compare=False)
+    # move ordering: up to 2 quiet moves per ply that caused a cutoff, and a cutoff score per move (per search)
+    _killers: list[list[Tuple[int, int]]] = field(default_factory=list, repr=False, compare=False)
+    _history: dict[Tuple[int, int], int] = field(default_factory=dict, repr=False, compare=False)
+    # number of units on the board per player, per unit type
+    _unit_counts: list[list[int]] = field(default_factory=list, repr=False, compare=False)
+    _zobrist: int = field(default=0, repr=False, compare=False)
+    _zobrist_keys: list[int] = field(default_factory=list, repr=False, compare=False)
+    # transposition table: zobrist hash -> (depth, score, bound, best move), shared between clones
+    # (move lists are not kept: a revisit searches the best move before generating the others)
+    _transposition_table: dict[int, Tuple[int, int, BoundType, Tuple[int, int]]] = \
+        field(default_factory=dict, repr=False, compare=False)
+    # class variable: signed e0 weight of a unit per player, per unit type (based on the enum constants in order)
+    e0_weights: ClassVar[list[list[int]]] = [
+        [9999, 3, 3, 3, 3],  # Attacker
+        [-9999, -3, -3, -3, -3],  # Defender
+    ]
+    # class variable: search order of moves by action, most likely to cause a cutoff first
+    action_order: ClassVar[dict[ActionType, int]] = {
+        ActionType.ATTACK: 0,
+        ActionType.REPAIR: 1,
+        ActionType.MOVE: 2,
+        ActionType.SUICIDE: 3,
+    }
 
     def __post_init__(self):
         """Automatically called after class init to set up the default board state."""
         dim = self.options.dim
-        self.board = [[None for _ in range(dim)] for _ in range(dim)]
+        self.board = [None] * (dim * dim)
+        self._unit_counts = [[0] * len(UnitType) for _ in Player]
+        self._zobrist = 0
+        self._zobrist_keys = zobrist_table(dim)
         md = dim - 1
         self.set(Coord(0, 0), Unit(player=Player.Defender, type=UnitType.AI))
         self.set(Coord(1, 0), Unit(player=Player.Defender, type=UnitType.Tech))
@@ -284,74 +418,105 @@ class Game:
         self.set(Coord(md - 1, md - 1), Unit(player=Player.Attacker, type=UnitType.Firewall))
 
     def clone(self) -> Game:
-        """Make a new copy of a game for minimax recursion.
+        """Make a new copy of a game.
 
         Shallow copy of everything except the board (options and stats are shared).
         """
         new = copy.copy(self)
-        new.board = copy.deepcopy(self.board)
+        new.board = [None if unit is None else unit.clone() for unit in self.board]
+        new._unit_counts = [counts[:] for counts in self._unit_counts]
         return new
 
     def is_empty(self, coord: Coord) -> bool:
         """Check if contents of a board cell of the game at Coord is empty (must be valid coord)."""
-        return self.board[coord.row][coord.col] is None
+        return self.board[coord.row * self.options.dim + coord.col] is None
 
     def get(self, coord: Coord) -> Unit | None:
         """Get contents of a board cell of the game at Coord."""
         if self.is_valid_coord(coord):
-            return self.board[coord.row][coord.col]
+            return self.board[coord.row * self.options.dim + coord.col]
         else:
             return None
 
+    def get_unchecked(self, index: int) -> Unit | None:
+        """Get contents of the board cell at a flat index (must be a valid index)."""
+        return self.board[index]
+
     def set(self, coord: Coord, unit: Unit | None):
         """Set contents of a board cell of the game at Coord."""
         if self.is_valid_coord(coord):
-            self.board[coord.row][coord.col] = unit
+            self.set_unchecked(coord.row * self.options.dim + coord.col, unit)
+
+    def set_unchecked(self, index: int, unit: Unit | None):
+        """Set contents of the board cell at a flat index (must be a valid index)."""
+        old_unit = self.board[index]
+        if old_unit is not None:
+            self._zobrist ^= self.zobrist_key(index, old_unit)
+            self._unit_counts[old_unit.player_idx][old_unit.type_idx] -= 1
+        if unit is not None:
+            self._zobrist ^= self.zobrist_key(index, unit)
+            self._unit_counts[unit.player_idx][unit.type_idx] += 1
+        self.board[index] = unit
+
+    def zobrist_key(self, index: int, unit: Unit) -> int:
+        """Zobrist key of a unit standing on the board cell at flat index."""
+        return self._zobrist_keys[((index * 2 + unit.player_idx) * 5 + unit.type_idx) * 10 + unit.health]
 
     def remove_dead(self, coord: Coord):
         """Remove unit at Coord if dead."""
-        unit = self.get(coord)
+        if self.is_valid_coord(coord):
+            self.remove_dead_unchecked(coord.row * self.options.dim + coord.col)
+
+    def remove_dead_unchecked(self, index: int):
+        """Remove unit at a flat index if dead (must be a valid index)."""
+        unit = self.board[index]
         if unit is not None and not unit.is_alive():
-            self.set(coord, None)
-            if unit.type == UnitType.AI:
-                if unit.player == Player.Attacker:
+            self.set_unchecked(index, None)
+            if unit.type_idx == 0:
+                if unit.player_idx == 0:
                     self._attacker_has_ai = False
                 else:
                     self._defender_has_ai = False
 
     def mod_health(self, coord: Coord, health_delta: int):
         """Modify health of unit at Coord (positive or negative delta)."""
-        target = self.get(coord)
+        if self.is_valid_coord(coord):
+            self.mod_health_unchecked(coord.row * self.options.dim + coord.col, health_delta)
+
+    def mod_health_unchecked(self, index: int, health_delta: int):
+        """Modify health of unit at a flat index (must be a valid index)."""
+        target = self.board[index]
         if target is not None:
+            self._zobrist ^= self.zobrist_key(index, target)
             target.mod_health(health_delta)
-            self.remove_dead(coord)
+            self._zobrist ^= self.zobrist_key(index, target)
+            self.remove_dead_unchecked(index)
 
     def is_valid_move(self, coords: CoordPair) -> bool:
         """Validate a move expressed as a CoordPair. TODO: WRITE MISSING CODE!!!"""
         if not self.is_valid_coord(coords.src) or not self.is_valid_coord(coords.dst):
             return False
 
-        src_unit = self.get(coords.src)
-        if src_unit is None or src_unit.player != self.next_player:
+        dim = self.options.dim
+        src_unit = self.get_unchecked(coords.src.row * dim + coords.src.col)
+        if src_unit is None or src_unit.player is not self.next_player:
             return False
 
-        if coords.src != coords.dst:
-            for coord in coords.src.iter_adjacent():
-                if coord == coords.dst:
-                    if self.get(coord) is not None:
-                        return True
-                    else:
-                        return self.unit_movement_restriction(coords)
+        if coords.src == coords.dst:
+            return True
+        if abs(coords.dst.row - coords.src.row) + abs(coords.dst.col - coords.src.col) != 1:
             return False
-        else:
+        if self.get_unchecked(coords.dst.row * dim + coords.dst.col) is not None:
             return True
+        return self.unit_movement_restriction(coords)
 
     def perform_move(self, coords: CoordPair) -> Tuple[bool, str]:
         """Validate and perform a move expressed as a CoordPair. TODO: WRITE MISSING CODE!!!"""
         if self.is_valid_move(coords):
-            src_unit = self.get(coords.src)
-            dst_unit = self.get(coords.dst)
-            action: ActionType = self.determine_action(coords)
+            dim = self.options.dim
+            src_unit = self.get_unchecked(coords.src.row * dim + coords.src.col)
+            dst_unit = self.get_unchecked(coords.dst.row * dim + coords.dst.col)
+            action: ActionType = self.determine_action_fast(src_unit, dst_unit, coords.src == coords.dst)
 
             if action == ActionType.MOVE:
                 return self.perform_movement(coords)
@@ -365,10 +530,64 @@ class Game:
 
         return (False, "invalid move")
 
+    def perform_move_fast(self, src_index: int, dst_index: int) -> bool:
+        """Perform an already validated (src, dst) flat index move without building a result message."""
+        board = self.board
+        src_unit = board[src_index]
+        dst_unit = board[dst_index]
+        if src_index == dst_index:
+            self.perform_suicide_fast(src_index)
+        elif dst_unit is None:
+            self.perform_movement_fast(src_index, dst_index)
+        elif src_unit.player_idx == dst_unit.player_idx:
+            return self.perform_repair_fast(dst_index, src_unit, dst_unit)
+        else:
+            self.perform_attack_fast(src_index, dst_index, src_unit, dst_unit)
+        return True
+
+    def do_move(self, move: Tuple[int, int]) -> UndoRecord | None:
+        """Perform a (src, dst) flat index move and pass the turn in place.
+
+        Returns how to undo it, or None if the move failed.
+        """
+        (src_index, dst_index) = move
+        record = UndoRecord(next_player=self.next_player, turns_played=self.turns_played,
+                            attacker_has_ai=self._attacker_has_ai, defender_has_ai=self._defender_has_ai,
+                            zobrist=self._zobrist)
+        affected = range_table(self.options.dim)[src_index] if src_index == dst_index else move
+        for index in affected:
+            unit = self.board[index]
+            record.cells.append((index, unit, 0 if unit is None else unit.health))
+        if not self.perform_move_fast(src_index, dst_index):
+            self.undo_move(record)
+            return None
+        self.next_turn()
+        return record
+
+    def undo_move(self, record: UndoRecord):
+        """Restore the state saved by do_move."""
+        counts = self._unit_counts
+        for (index, unit, health) in record.cells:
+            current = self.board[index]
+            if current is not unit:
+                if current is not None:
+                    counts[current.player_idx][current.type_idx] -= 1
+                if unit is not None:
+                    counts[unit.player_idx][unit.type_idx] += 1
+                self.board[index] = unit
+            if unit is not None:
+                unit.health = health
+        self.next_player = record.next_player
+        self.turns_played = record.turns_played
+        self._attacker_has_ai = record.attacker_has_ai
+        self._defender_has_ai = record.defender_has_ai
+        self._zobrist = record.zobrist
+
     def next_turn(self):
         """Transitions game to the next turn."""
         self.next_player = self.next_player.next()
         self.turns_played += 1
+        self._zobrist ^= ZOBRIST_SIDE_KEY
 
     def to_string(self) -> str:
         """Pretty text representation of the game."""
@@ -389,7 +608,7 @@ class Game:
             output += f"{label}: "
             for col in range(dim):
                 coord.col = col
-                unit = self.get(coord)
+                unit = self.get_unchecked(row * dim + col)
                 if unit is None:
                     output += " .  "
                 else:
@@ -416,10 +635,8 @@ class Game:
             if coords is not None and self.is_valid_coord(coords.src) and self.is_valid_coord(coords.dst):
                 return coords
             else:
-                f = open(Options.file, "a")
-                f.write('Invalid coordinates! Try again.\n')
+                self.trace('Invalid coordinates! Try again.')
                 print('Invalid coordinates! Try again.')
-                f.close()
 
     def human_turn(self):
         """Human player plays a move (or get via broker)."""
@@ -432,6 +649,7 @@ class Game:
                     print(f"Broker {self.next_player.name}: ", end='')
                     print(result)
                     if success:
+                        self.trace(result)
                         self.next_turn()
                         break
                 sleep(0.1)
@@ -442,13 +660,12 @@ class Game:
                 if success:
                     print(f"Player {self.next_player.name}: ", end='')
                     print(result)
+                    self.trace(result)
                     self.next_turn()
                     break
                 else:
                     print("The move is not valid! Try again.")
-                    f = open(Options.file, "a")
-                    f.write("The move is not valid! Try again.\n")
-                    f.close()
+                    self.trace("The move is not valid! Try again.")
 
     def computer_turn(self) -> CoordPair | None:
         """Computer plays a move."""
@@ -458,15 +675,40 @@ class Game:
             if success:
                 print(f"Computer {self.next_player.name}: ", end='')
                 print(result)
+                self.trace(result)
                 self.next_turn()
         return mv
 
+    def trace(self, message: str, end: str = '\n'):
+        """Write to the game trace file, which is created on first use and kept open for the rest of the game."""
+        if self._trace_file is None:
+            self._trace_file = open(self.options.file, "w", buffering=1 << 16)
+        self._trace_file.write(message + end)
+
+    def close_trace(self):
+        """Flush and close the game trace file."""
+        if self._trace_file is not None:
+            self._trace_file.close()
+            self._trace_file = None
+
+    def close(self):
+        """Release the game's resources: the trace file and the root search worker processes."""
+        self.close_trace()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def move_to_coords(self, move: Tuple[int, int]) -> CoordPair:
+        """Convert a (src, dst) flat index move to a CoordPair."""
+        dim = self.options.dim
+        return CoordPair.from_quad(move[0] // dim, move[0] % dim, move[1] // dim, move[1] % dim)
+
     def player_units(self, player: Player) -> Iterable[Tuple[Coord, Unit]]:
         """Iterates over all units belonging to a player."""
-        for coord in CoordPair.from_dim(self.options.dim).iter_rectangle():
-            unit = self.get(coord)
-            if unit is not None and unit.player == player:
-                yield (coord, unit)
+        dim = self.options.dim
+        for (index, unit) in enumerate(self.board):
+            if unit is not None and unit.player is player:
+                yield (Coord(index // dim, index % dim), unit)
 
     def is_finished(self) -> bool:
         """Check if the game is over."""
@@ -483,33 +725,262 @@ class Game:
                 return Player.Attacker
         return Player.Defender
 
-    def move_candidates(self) -> Iterable[CoordPair]:
-        """Generate valid move candidates for the next player."""
-        move = CoordPair()
-        for (src, _) in self.player_units(self.next_player):
-            move.src = src
-            for dst in src.iter_adjacent():
-                move.dst = dst
-                if self.is_valid_move(move):
-                    yield move.clone()
-            move.dst = src
-            yield move.clone()
+    def move_candidates(self) -> Iterable[Tuple[int, int]]:
+        """Generate valid move candidates for the next player as (src, dst) flat board indices."""
+        board = self.board
+        moves = move_table(self.options.dim)
+        player = self.next_player
+        for (src_index, unit) in enumerate(board):
+            if unit is None or unit.player is not player:
+                continue
+            for move in moves[src_index]:
+                dst_index = move[1]
+                if dst_index == src_index or board[dst_index] is not None or self.can_move(src_index, dst_index):
+                    yield move
+
+    def ordered_moves(self, ply: int = 0, first_move: Tuple[int, int] | None = None) -> list[Tuple[int, int]]:
+        """Move candidates sorted for alpha-beta.
+
+        first_move (the transposition table's best move) comes first, then attacks, then the killer moves
+        of this ply, then repairs, movements and self-destructs, each group by decreasing history score.
+        """
+        board = self.board
+        action_order = self.action_order
+        killers = self._killers[ply] if ply < len(self._killers) else ()
+        history = self._history
+
+        def order(move: Tuple[int, int]) -> Tuple[bool, bool, bool, int, int]:
+            (src_index, dst_index) = move
+            action = self.determine_action_fast(board[src_index], board[dst_index], src_index == dst_index)
+            return (move != first_move, action is not ActionType.ATTACK, move not in killers, action_order[action],
+                    -history.get(move, 0))
+
+        return sorted(self.move_candidates(), key=order)
+
+    def search_order(self, ply: int, first_move: Tuple[int, int] | None) -> Iterable[Tuple[int, int]]:
+        """Yield first_move, then the other ordered_moves, which are only generated if the search asks for them."""
+        if first_move is not None:
+            yield first_move
+        for move in self.ordered_moves(ply):
+            if move != first_move:
+                yield move
+
+    def record_cutoff(self, move: Tuple[int, int], depth: int, ply: int):
+        """Remember a move that caused a beta cutoff, as a killer (if not an attack) and in the history."""
+        (src_index, dst_index) = move
+        board = self.board
+        action = self.determine_action_fast(board[src_index], board[dst_index], src_index == dst_index)
+        if action is not ActionType.ATTACK:
+            while len(self._killers) <= ply:
+                self._killers.append([])
+            killers = self._killers[ply]
+            if move not in killers:
+                killers.insert(0, move)
+                del killers[2:]
+        self._history[move] = self._history.get(move, 0) + depth * depth
 
     def random_move(self) -> Tuple[int, CoordPair | None, float]:
         """Returns a random move."""
-        move_candidates = list(self.move_candidates())
-        random.shuffle(move_candidates)
+        move_candidates = tuple(self.move_candidates())
         if len(move_candidates) > 0:
-            return (0, move_candidates[0], 1)
+            return (0, self.move_to_coords(random.choice(move_candidates)), 1)
         else:
             return (0, None, 0)
 
+    def calculate_heuristic(self) -> int:
+        """Heuristic e0 from the attacker's point of view: weighted unit count of attacker minus defender."""
+        winner = self.has_winner()
+        if winner is Player.Attacker:
+            return MAX_HEURISTIC_SCORE
+        elif winner is Player.Defender:
+            return MIN_HEURISTIC_SCORE
+        score = 0
+        for (weights, counts) in zip(self.e0_weights, self._unit_counts):
+            for (weight, count) in zip(weights, counts):
+                score += weight * count
+        return score
+
+    def negamax(self, depth: int, ply: int, alpha: int, beta: int,
+                deadline_ns: int | None) -> Tuple[int, Tuple[int, int] | None, float]:
+        """Negamax search (with optional alpha-beta pruning) of depth plies.
+
+        Scores are from the point of view of the player to move (the negated heuristic for the defender).
+        deadline_ns is a time.monotonic_ns() value (None for no time limit), checked every 1024 nodes.
+        Returns the score, the best move found and the average depth of the evaluated leaves.
+        """
+        (alpha_orig, beta_orig) = (alpha, beta)
+        # the hash leaves out turns_played, so a score is only shared while the turn limit is beyond its horizon
+        max_turns = self.options.max_turns
+        turns_left = MAX_HEURISTIC_SCORE if max_turns is None else max_turns - self.turns_played
+        entry = self._transposition_table.get(self._zobrist)
+        if entry is not None and depth <= entry[0] < turns_left:
+            (_, score, bound, best_move) = entry
+            if bound is BoundType.EXACT:
+                return (score, best_move, ply)
+            elif bound is BoundType.LOWER:
+                alpha = max(alpha, score)
+            else:
+                beta = min(beta, score)
+            if alpha >= beta:
+                return (score, best_move, ply)
+
+        if deadline_ns is not None and not self._timed_out:
+            self._node_count += 1
+            if self._node_count & 1023 == 0 and monotonic_ns() >= deadline_ns:
+                self._timed_out = True
+        min_depth = self.options.min_depth if self.options.min_depth is not None else 0
+        color = 1 if self.next_player is Player.Attacker else -1
+        if depth <= 0 or (self._timed_out and ply >= min_depth) or self.is_finished():
+            self.stats.evaluations_per_depth[ply] = self.stats.evaluations_per_depth.get(ply, 0) + 1
+            return (color * self.calculate_heuristic(), None, ply)
+
+        alpha_beta = self.options.alpha_beta
+        best_score = MIN_HEURISTIC_SCORE
+        best_move = None
+        total_depth = 0.0
+        children = 0
+        # a position searched before tries the best move found then first, before the others are generated
+        moves = self.search_order(ply, None if entry is None else entry[3])
+        for move in moves:
+            record = self.do_move(move)
+            if record is None:
+                continue
+            (score, _, child_depth) = self.negamax(depth - 1, ply + 1, -beta, -alpha, deadline_ns)
+            score = -score
+            self.undo_move(record)
+            total_depth += child_depth
+            children += 1
+            if best_move is None or score > best_score:
+                (best_score, best_move) = (score, move)
+            alpha = max(alpha, score)
+            if alpha_beta and alpha >= beta:
+                self.record_cutoff(move, depth, ply)
+                break
+        if best_move is None:
+            self.stats.evaluations_per_depth[ply] = self.stats.evaluations_per_depth.get(ply, 0) + 1
+            return (color * self.calculate_heuristic(), None, ply)
+
+        if not self._timed_out:
+            # a search cut short by the time limit is not stored, its score is not reliable
+            if best_score <= alpha_orig:
+                bound = BoundType.UPPER
+            elif best_score >= beta_orig:
+                bound = BoundType.LOWER
+            else:
+                bound = BoundType.EXACT
+            self.store_transposition(depth, best_score, bound, best_move)
+        return (best_score, best_move, total_depth / children)
+
+    def store_transposition(self, depth: int, score: int, bound: BoundType, best_move: Tuple[int, int]):
+        """Store a search result for this position, unless the turn limit is within depth or the table is full."""
+        max_turns = self.options.max_turns
+        if max_turns is not None and self.turns_played + depth >= max_turns:
+            return
+        table = self._transposition_table
+        if len(table) < MAX_TRANSPOSITION_ENTRIES or self._zobrist in table:
+            table[self._zobrist] = (depth, score, bound, best_move)
+
+    def parallel_root_search(self, depth: int, deadline_ns: int | None) -> Tuple[int, Tuple[int, int] | None, float]:
+        """Search the root moves in worker processes, returning the same result as negamax at ply 0.
+
+        The first root move (the transposition table's best move) is searched here for a score to beat.
+        The other moves are handed out one per idle worker with the best score so far as alpha, so that a
+        worker only has to prove a move is no better. The root result goes in the transposition table,
+        which orders the next iteration; the workers keep their own tables.
+        """
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.options.workers)
+        entry = self._transposition_table.get(self._zobrist)
+        moves = enumerate(self.ordered_moves(0, None if entry is None else entry[3]))
+        best_score = MIN_HEURISTIC_SCORE
+        best_move = None
+        best_index = 0
+        total_depth = 0.0
+        children = 0
+        for (best_index, move) in moves:
+            record = self.do_move(move)
+            if record is None:
+                continue
+            (score, _, total_depth) = self.negamax(depth - 1, 1, MIN_HEURISTIC_SCORE, MAX_HEURISTIC_SCORE,
+                                                   deadline_ns)
+            self.undo_move(record)
+            (best_score, best_move) = (-score, move)
+            children = 1
+            break
+        if best_move is None:
+            return (0, None, 0.0)
+
+        board = list(self.board)
+        # future -> (index of the move in search order, move, alpha it was searched with)
+        running: dict[Future, Tuple[int, Tuple[int, int], int]] = {}
+        while True:
+            while len(running) < self.options.workers:
+                # a pass that hit the time limit is discarded, so no more root moves are handed out
+                if deadline_ns is not None and not self._timed_out and monotonic_ns() >= deadline_ns:
+                    self._timed_out = True
+                if self._timed_out:
+                    break
+                (index, move) = next(moves, (None, None))
+                if move is None:
+                    break
+                alpha = best_score if self.options.alpha_beta else MIN_HEURISTIC_SCORE
+                future = self._executor.submit(search_root_move, self.options, board, self.next_player,
+                                               self.turns_played, move, depth, alpha, deadline_ns)
+                running[future] = (index, move, alpha)
+            if len(running) == 0:
+                break
+            (done, _) = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                (index, move, alpha) = running.pop(future)
+                (score, child_depth, evaluations, timed_out) = future.result()
+                for (ply, count) in evaluations.items():
+                    self.stats.evaluations_per_depth[ply] = self.stats.evaluations_per_depth.get(ply, 0) + count
+                self._timed_out = self._timed_out or timed_out
+                if score is None:
+                    continue
+                total_depth += child_depth
+                children += 1
+                # a score above its alpha is exact; ties go to the earlier move, like negamax
+                if score > best_score or (score == best_score and score > alpha and index < best_index):
+                    (best_score, best_move, best_index) = (score, move, index)
+        if not self._timed_out:
+            self.store_transposition(depth, best_score, BoundType.EXACT, best_move)
+        return (best_score, best_move, total_depth / children)
+
     def suggest_move(self) -> CoordPair | None:
-        """Suggest the next move using minimax alpha beta. TODO: REPLACE RANDOM_MOVE WITH PROPER GAME LOGIC!!!"""
-        start_time = datetime.now()
-        (score, move, avg_depth) = self.random_move()
-        elapsed_seconds = (datetime.now() - start_time).total_seconds()
+        """Suggest the next move using iterative deepening negamax alpha beta.
+
+        Each iteration searches one ply deeper, trying the previous iteration's best move first (via the
+        transposition table). An iteration cut short by the time limit is discarded in favour of the last
+        complete one, and no new iteration is started once half of the time budget is spent.
+        """
+        start_ns = monotonic_ns()
+        max_depth = self.options.max_depth if self.options.max_depth is not None else 4
+        max_time = self.options.max_time
+        deadline_ns = None if max_time is None else start_ns + int(max_time * 1e9)
+        if len(self._transposition_table) >= MAX_TRANSPOSITION_ENTRIES:
+            self._transposition_table.clear()
+        self._node_count = 0
+        self._timed_out = False
+        self._killers.clear()
+        self._history.clear()
+        (score, best_move, avg_depth) = (0, None, 0.0)
+        for depth in range(1, max_depth + 1):
+            if self.options.workers > 1 and depth > 1:
+                result = self.parallel_root_search(depth, deadline_ns)
+            else:
+                result = self.negamax(depth, 0, MIN_HEURISTIC_SCORE, MAX_HEURISTIC_SCORE, deadline_ns)
+            if self._timed_out and best_move is not None:
+                break
+            (score, best_move, avg_depth) = result
+            if max_time is not None and monotonic_ns() - start_ns > max_time * 0.5e9:
+                break
+        move = None if best_move is None else self.move_to_coords(best_move)
+        elapsed_seconds = (monotonic_ns() - start_ns) / 1e9
         self.stats.total_seconds += elapsed_seconds
+        # report the score from the attacker's point of view, like calculate_heuristic
+        if self.next_player is Player.Defender:
+            score = -score
         print(f"Heuristic score: {score}")
         print(f"Average recursive depth: {avg_depth:0.1f}")
         print(f"Evals per depth: ", end='')
@@ -574,89 +1045,140 @@ class Game:
     def determine_action(self, coords: CoordPair) -> ActionType:
         src_unit = self.get(coords.src)
         dst_unit = self.get(coords.dst)
-        if coords.src == coords.dst:
+        return self.determine_action_fast(src_unit, dst_unit, coords.src == coords.dst)
+
+    def determine_action_fast(self, src_unit: Unit, dst_unit: Unit | None, is_self_target: bool) -> ActionType:
+        """Action of a move, given the units already read from its source and destination cells."""
+        if is_self_target:
             return ActionType.SUICIDE
+        elif dst_unit is None:
+            return ActionType.MOVE
+        elif src_unit.player_idx == dst_unit.player_idx:
+            return ActionType.REPAIR
         else:
-            if dst_unit is None:
-                return ActionType.MOVE
-            else:
-                if src_unit.player == dst_unit.player:
-                    return ActionType.REPAIR
-                else:
-                    return ActionType.ATTACK
+            return ActionType.ATTACK
 
     def perform_attack(self, coords: CoordPair, src_unit: Unit, dst_unit: Unit) -> Tuple[bool, str]:
-        src_damage = src_unit.damage_table[src_unit.type.value][dst_unit.type.value] * -1
-        dst_damage = src_unit.damage_table[dst_unit.type.value][src_unit.type.value] * -1
-        self.mod_health(coords.src, src_damage)
-        self.mod_health(coords.dst, dst_damage)
-        f = open(Options.file, "a")
-        f.write('attack from ' +str(coords.src) + ' to ' + str(coords.dst)+ '\n' + 
-                'combat damage to source = ' +  str(src_damage*-1) + ' , to target = ' + str(dst_damage*-1) + '\n')
-        f.close()
+        dim = self.options.dim
+        self.perform_attack_fast(coords.src.row * dim + coords.src.col, coords.dst.row * dim + coords.dst.col,
+                                 src_unit, dst_unit)
+        src_damage = Unit.damage_table[src_unit.type_idx][dst_unit.type_idx]
+        dst_damage = Unit.damage_table[dst_unit.type_idx][src_unit.type_idx]
         return (True,'attack from ' +str(coords.src) + ' to ' + str(coords.dst)+ '\n' + 
-                'combat damage to source = ' +  str(src_damage*-1) + ' , to target = ' + str(dst_damage*-1))
+                'combat damage to source = ' +  str(src_damage) + ' , to target = ' + str(dst_damage))
+
+    def perform_attack_fast(self, src_index: int, dst_index: int, src_unit: Unit, dst_unit: Unit):
+        (src_type, dst_type) = (src_unit.type_idx, dst_unit.type_idx)
+        damage_lut = Unit.damage_lut
+        # both amounts are read (already clamped to the health left) before either unit is hit
+        src_damage = damage_lut[src_type][dst_type][src_unit.health]
+        dst_damage = damage_lut[dst_type][src_type][dst_unit.health]
+        self.mod_health_unchecked(src_index, -src_damage)
+        self.mod_health_unchecked(dst_index, -dst_damage)
 
     def perform_repair(self, coords: CoordPair, src_unit: Unit, dst_unit: Unit) -> Tuple[bool, str]:
-        repair = src_unit.repair_table[src_unit.type.value][dst_unit.type.value]
-        if repair == 0:
-            return (False,"")
-        elif dst_unit.health == 9:
+        repair = Unit.repair_table[src_unit.type_idx][dst_unit.type_idx]
+        if not self.perform_repair_fast(coords.dst.row * self.options.dim + coords.dst.col, src_unit, dst_unit):
             return (False,"")
-        self.mod_health(coords.dst, repair)
-        f = open(Options.file, "a")
-        f.write('repair from ' +str(coords.src) + ' to ' + str(coords.dst) + '\n' +
-                 "repaired " + str(repair) + ' health point' + '\n')
-        f.close()
         return (True, 'repair from ' +str(coords.src) + ' to ' + str(coords.dst) + '\n' +
                  "repaired " + str(repair) + ' health point')
 
+    def perform_repair_fast(self, dst_index: int, src_unit: Unit, dst_unit: Unit) -> bool:
+        # 0 if this unit type cannot repair the target's type or the target is already at full health
+        repair = Unit.repair_lut[src_unit.type_idx][dst_unit.type_idx][dst_unit.health]
+        if repair == 0:
+            return False
+        self.mod_health_unchecked(dst_index, repair)
+        return True
+
     def perform_movement(self, coords: CoordPair) -> Tuple[bool, str]:
-        self.set(coords.dst, self.get(coords.src))
-        self.set(coords.src, None)
-        f = open(Options.file, "a")
-        f.write('move from ' +str(coords.src) + ' to ' + str(coords.dst) + '\n')
-        f.close()
+        dim = self.options.dim
+        self.perform_movement_fast(coords.src.row * dim + coords.src.col, coords.dst.row * dim + coords.dst.col)
         return (True, 'move from ' +str(coords.src) + ' to ' + str(coords.dst))
 
+    def perform_movement_fast(self, src_index: int, dst_index: int):
+        self.set_unchecked(dst_index, self.get_unchecked(src_index))
+        self.set_unchecked(src_index, None)
+
     def perform_suicide(self, coords: CoordPair) -> Tuple[bool, str]:
-        self.mod_health(coords.src, -9)
-        # Loop through all elements in the rectangular area of coords.src
+        total_damage = self.perform_suicide_fast(coords.src.row * self.options.dim + coords.src.col)
+        return (True, "self-destruct at " + str(coords.src) + ' and deals ' + str(total_damage) + ' total damage' )
+
+    def perform_suicide_fast(self, src_index: int) -> int:
+        """Self-destruct the unit at src_index and return the total damage dealt."""
+        self.mod_health_unchecked(src_index, -9)
+        # Loop through all elements in the rectangular area of the source cell
         total_damage = 0
-        for coord in coords.src.iter_range(1):
-            if self.get(coord) is not None:
-                self.mod_health(coord, -2)
+        for index in range_table(self.options.dim)[src_index]:
+            if self.get_unchecked(index) is not None:
+                self.mod_health_unchecked(index, -2)
                 total_damage += 2
-        f = open(Options.file, "a")
-        f.write("self-destruct at " + str(coords.src) + ' and deals ' + str(total_damage) + ' total damage' + '\n')
-        f.close()
-        return (True, "self-destruct at " + str(coords.src) + ' and deals ' + str(total_damage) + ' total damage' )
+        return total_damage
 
     def unit_movement_restriction(self, coords: CoordPair) -> bool:
-        src_unit = self.get(coords.src)
+        dim = self.options.dim
+        return self.can_move(coords.src.row * dim + coords.src.col, coords.dst.row * dim + coords.dst.col)
 
-        row_dst = coords.dst.row - coords.src.row
-        col_dst = coords.dst.col - coords.src.col
+    def can_move(self, src_index: int, dst_index: int) -> bool:
+        """Check the movement restrictions of the unit at src_index moving to the adjacent cell dst_index."""
+        src_unit = self.board[src_index]
 
-        # AI, Firewall and program move restrictions
-        if src_unit.type in [UnitType.AI, UnitType.Firewall, UnitType.Program]:
-            if src_unit.player == Player.Attacker:
-                if row_dst > 0 or col_dst > 0:
+        # AI, Firewall and program move restrictions (type indices 0, 4 and 3)
+        if src_unit.type_idx in (0, 3, 4):
+            # on a row-major board a move down or right increases the flat index
+            if src_unit.player_idx == 0:
+                if dst_index > src_index:
                     return False
             else:
-                if row_dst < 0 or col_dst < 0:
+                if dst_index < src_index:
                     return False
 
             # Checks if the Player 1 Unit is adjacent to Player 2 Unit
-            for coord in coords.src.iter_adjacent():
-                unit = self.get(coord)
-                if unit is not None:
-                    if src_unit.type in [UnitType.AI, UnitType.Firewall, UnitType.Program] \
-                            and src_unit.player != unit.player:
-                        return False
+            board = self.board
+            for index in adjacent_table(self.options.dim)[src_index]:
+                unit = board[index]
+                if unit is not None and src_unit.player_idx != unit.player_idx:
+                    return False
         return True
 
 
+##############################################################################################################
+
+# transposition table of a root search worker process, kept between the root moves it is given
+_worker_transposition_table: dict[int, Tuple[int, int, BoundType, Tuple[int, int]]] = {}
+
+
+def search_root_move(options: Options, board: list[Unit | None], next_player: Player, turns_played: int,
+                     move: Tuple[int, int], depth: int, alpha: int,
+                     deadline_ns: int | None) -> Tuple[int | None, float, dict[int, int], bool]:
+    """Worker side of Game.parallel_root_search: play one root move on a rebuilt game and search the reply.
+
+    Returns the move's score for the player who made it (None if the move failed; at most alpha if the
+    move is no better than alpha), the average leaf depth, the evaluations per depth and whether the time
+    limit was hit.
+    """
+    if len(_worker_transposition_table) >= MAX_TRANSPOSITION_ENTRIES:
+        _worker_transposition_table.clear()
+    game = Game(options=options, _transposition_table=_worker_transposition_table)
+    for index in range(len(game.board)):
+        game.set_unchecked(index, None)
+    for (index, unit) in enumerate(board):
+        if unit is not None:
+            game.set_unchecked(index, unit)
+    game._attacker_has_ai = game._unit_counts[Player.Attacker.value][UnitType.AI.value] > 0
+    game._defender_has_ai = game._unit_counts[Player.Defender.value][UnitType.AI.value] > 0
+    game.turns_played = turns_played
+    # the first node reads the clock, instead of searching 1024 nodes past an expired deadline
+    game._node_count = 1023
+    if next_player is not game.next_player:
+        game.next_player = next_player
+        game._zobrist ^= ZOBRIST_SIDE_KEY
+    if game.do_move(move) is None:
+        return (None, 0.0, {}, False)
+    (score, _, avg_depth) = game.negamax(depth - 1, 1, MIN_HEURISTIC_SCORE, -alpha, deadline_ns)
+    return (-score, avg_depth, game.stats.evaluations_per_depth, game._timed_out)
+
+
 ##############################################################################################################
 
 def main():
@@ -668,6 +1190,7 @@ def main():
     parser.add_argument('--max_time', type=float, help='maximum search time')
     parser.add_argument('--game_type', type=str, default="manual", help='game type: auto|attacker|defender|manual')
     parser.add_argument('--broker', type=str, help='play via a game broker')
+    parser.add_argument('--workers', type=int, help='number of processes searching root moves in parallel')
     args = parser.parse_args()
 
     # parse the game type
@@ -690,30 +1213,28 @@ def main():
         options.max_time = args.max_time
     if args.broker is not None:
         options.broker = args.broker
+    if args.workers is not None:
+        options.workers = args.workers
 
     # create a new game
     game = Game(options=options)
 
     # the main game loop
 
-    f = open(Options.file, "w")
-    f.write('Game set to ' + str(options.max_turns) + ' turns \n')
-    f.write('Game set to ' + str(options.max_time) + ' sec per turn \n')
-    f.write(str(options.game_type)[9:] + '\n')
-    f.write("alpha-beta is " + str(options.alpha_beta) + "\n")
+    game.trace('Game set to ' + str(options.max_turns) + ' turns ')
+    game.trace('Game set to ' + str(options.max_time) + ' sec per turn ')
+    game.trace(str(options.game_type)[9:])
+    game.trace("alpha-beta is " + str(options.alpha_beta))
     while True:
         print()
         print(game)
 
-        f = open(Options.file, "a")
-        f.write(str(game))
-        f.close()
+        game.trace(str(game), end='')
         winner = game.has_winner()
         if winner is not None:
             print(f"{winner.name} wins in " + str(game.turns_played) + " turns")
-            f = open(Options.file, "a")
-            f.write(f"{winner.name} wins in " + str(game.turns_played) + " turns")
-            f.close()
+            game.trace(f"{winner.name} wins in " + str(game.turns_played) + " turns", end='')
+            game.close()
             break
         if game.options.game_type == GameType.AttackerVsDefender:
             game.human_turn()